@@ -40,9 +40,8 @@ def create_directory_structure(base_path: Path) -> bool:
         
         # Create subdirectories
         for dir_name in directories:
-            dir_path = base_path / dir_name
-            dir_path.mkdir(parents=True, exist_ok=True)
-            print(f"✓ Created: {dir_path}")
+            (base_path / dir_name).mkdir(parents=True, exist_ok=True)
+        print(f"✓ Created {len(directories)} subdirectories")
         
         # Create a README in the base directory
         readme_path = base_path / "README.txt"
@@ -66,15 +65,11 @@ Processing photos with:
 """)
         print(f"✓ Created README: {readme_path}")
         
-        # Test write permissions
-        test_file = base_path / "test_write.tmp"
-        try:
-            test_file.touch()
-            test_file.unlink()
-            print("✓ Write permissions verified")
-        except Exception as e:
-            print(f"✗ No write permissions: {e}")
+        # Check write permissions
+        if not os.access(base_path, os.W_OK):
+            print(f"✗ No write permissions: {base_path}")
             return False
+        print("✓ Write permissions verified")
             
         return True
         
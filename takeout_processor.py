@@ -4,14 +4,26 @@ Google Takeout Photo Processor
 Processes Google Takeout archives and organizes photos on NAS
 """
 
-import json
-import shutil
+import functools
+import mmap
+import multiprocessing
+import os
+import queue
+import sqlite3
+import struct
+import threading
+import time
 import zipfile
+import zlib
+from collections import deque
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Set
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
 import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import blake3
 import click
+import orjson
 from PIL import Image
 from pillow_heif import register_heif_opener
 from tqdm import tqdm
@@ -19,12 +31,316 @@ from tqdm import tqdm
 # Register HEIF support
 register_heif_opener()
 
+# Read size for hashing; large blocks keep the per-chunk Python overhead low
+CHUNK_SIZE = 1024 * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+
+# Entries at least this large are read ahead by a thread, which inflates the
+# next chunks while the current one is hashed
+LARGE_FILE_THRESHOLD = 1024 * 1024
+
+# Chunk buffers shared by the read-ahead thread and the hasher
+READ_AHEAD_BUFFERS = 4
+
+# Dedup hash algorithms; BLAKE3 is SIMD-accelerated and much faster than SHA-256
+HASH_ALGORITHMS = ("blake3", "sha256")
+
+# Bytes of each digest kept in the dedup index; 128 bits make accidental
+# collisions negligible even for tens of millions of files
+DIGEST_SIZE = 16
+
+# Extension sets used to route files; built once instead of per file
+MEDIA_EXTENSIONS = frozenset({".jpg", ".jpeg", ".png", ".heic", ".heif", ".mp4", ".mov"})
+VIDEO_EXTENSIONS = frozenset({".mp4", ".mov", ".avi"})
+HEIC_EXTENSIONS = frozenset({".heic", ".heif"})
+
+# EXIF tags holding the capture time (DateTimeOriginal lives in the Exif IFD)
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+EXIF_DATETIME = 0x0132
+
+# CPUs this process may run on; unlike os.cpu_count this honours affinity
+# masks such as taskset or a container cpuset
+if hasattr(os, "sched_getaffinity"):
+    AVAILABLE_CPUS = len(os.sched_getaffinity(0))
+else:
+    AVAILABLE_CPUS = os.cpu_count() or 1
+
+# Workers are started from a clean forkserver (spawn where that is missing)
+# rather than forked from the main process while its pool and tqdm threads
+# are running
+if "forkserver" in multiprocessing.get_all_start_methods():
+    MP_CONTEXT = multiprocessing.get_context("forkserver")
+else:
+    MP_CONTEXT = multiprocessing.get_context("spawn")
+
+# Hashing runs in one worker process per CPU by default (see --workers);
+# files are queued up to this many ahead of the main loop's dedup decisions
+MAX_PENDING_FILES = 64
+
+# HEIC conversions allowed in flight before the main loop waits for the oldest
+MAX_PENDING_CONVERSIONS = 64
+
+# Dedup index inserts are grouped into one SQLite transaction and committed
+# after this many rows or seconds, whichever comes first
+DEDUP_COMMIT_INTERVAL = 500
+DEDUP_COMMIT_SECONDS = 2.0
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_date_prefix(timestamp: datetime) -> str:
+    """Format the date prefix of an output name; burst shots share theirs."""
+    return timestamp.strftime("%Y%m%d_%H%M%S")
+
+
+# Archive opened by the current worker process, set up by _open_worker_zip
+_worker_zip: Optional[zipfile.ZipFile] = None
+
+
+def _open_worker_zip(zip_path: Path) -> None:
+    """Open the archive in a worker process, giving it its own file handle."""
+    global _worker_zip
+    _worker_zip = zipfile.ZipFile(zip_path)
+    if hasattr(os, "posix_fadvise"):
+        # Ask the kernel for aggressive readahead on the archive
+        os.posix_fadvise(_worker_zip.fp.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+
+def _convert_heic_to_jpg(entry_name: str, output_path: Path,
+                         optimize: bool = False) -> None:
+    """Convert a HEIC archive entry to JPEG (runs in a worker process)."""
+    with _worker_zip.open(entry_name) as src:
+        image = Image.open(src)
+        
+        # Convert to RGB if necessary
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        # Save as JPEG with high quality; EXIF is passed through as the raw
+        # bytes libheif read, without parsing and re-serialising the IFDs
+        save_options = {}
+        exif = image.info.get('exif')
+        if exif:
+            save_options['exif'] = exif
+        # Single-pass baseline encode with 4:2:0 chroma, matching how phones
+        # store HEIC; Huffman optimisation is an opt-in second pass that saves
+        # only a few percent of file size
+        image.save(output_path, 'JPEG', quality=95, subsampling='4:2:0',
+                   progressive=False, optimize=optimize, **save_options)
+
+
+def _read_exif_timestamp(source) -> Optional[datetime]:
+    """Read the EXIF capture time; only the header is parsed, not pixels."""
+    try:
+        with Image.open(source) as image:
+            exif = image.getexif()
+            value = (exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL)
+                     or exif.get(EXIF_DATETIME))
+        if value:
+            # Fixed "YYYY:MM:DD HH:MM:SS" layout: slice instead of strptime
+            return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                            int(value[11:13]), int(value[14:16]), int(value[17:19]))
+    except Exception:
+        pass
+    return None
+
+
+class FileHasher:
+    """Computes dedup hashes, reusing its read buffers from file to file."""
+
+    def __init__(self, algorithm: str = "blake3", chunk_size: int = CHUNK_SIZE):
+        if chunk_size < MIN_CHUNK_SIZE:
+            raise ValueError(f"chunk_size must be at least {MIN_CHUNK_SIZE} bytes")
+        self.algorithm = algorithm
+        # Reused for every chunked read so hashing allocates no per-chunk bytes
+        self._read_buffer = memoryview(bytearray(chunk_size))
+        self._read_ahead_buffers = [bytearray(chunk_size) for _ in range(READ_AHEAD_BUFFERS)]
+
+    def calculate(self, source: BinaryIO, file_size: int,
+                  copy_to: Optional[Path] = None) -> bytes:
+        """Calculate the dedup hash of a stream, copying it to copy_to in the same pass."""
+        if copy_to is None:
+            return self._hash(source, file_size, None)
+        with open(copy_to, "wb") as dst:
+            return self._hash(source, file_size, dst)
+
+    def calculate_stored(self, fd: int, offset: int, file_size: int, crc: int,
+                         copy_to: Optional[Path] = None) -> bytes:
+        """Calculate the dedup hash of an uncompressed archive entry in place,
+        copying it to copy_to inside the kernel where possible."""
+        hasher = self._new_hasher()
+        # mmap offsets must be aligned, so map from the preceding boundary
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        with mmap.mmap(fd, offset - start + file_size, offset=start,
+                       access=mmap.ACCESS_READ) as mapped, \
+                memoryview(mapped) as view, view[offset - start:] as data:
+            # ZipFile.open would verify the CRC-32, so check it here as well
+            if zlib.crc32(data) != crc:
+                raise zipfile.BadZipFile("Bad CRC-32 for stored entry")
+            hasher.update(data)
+            if copy_to is not None:
+                with open(copy_to, "wb", buffering=0) as dst:
+                    _copy_range(fd, offset, file_size, dst, data)
+        return hasher.digest()[:DIGEST_SIZE]
+
+    def _new_hasher(self):
+        """Create the hasher for a file (BLAKE3 unless configured otherwise).
+
+        BLAKE3 stays single-threaded: hashing already runs in one worker
+        process per core, so its multithreaded mode would oversubscribe the CPU.
+        """
+        if self.algorithm != "blake3":
+            return hashlib.new(self.algorithm)
+        return blake3.blake3()
+
+    def _hash(self, source: BinaryIO, file_size: int, dst) -> bytes:
+        """Hash a stream, writing its bytes to dst."""
+        hasher = self._new_hasher()
+        if file_size >= LARGE_FILE_THRESHOLD:
+            self._hash_with_read_ahead(source, hasher, dst)
+            return hasher.digest()[:DIGEST_SIZE]
+        buffer = self._read_buffer
+        while n := source.readinto(buffer):
+            hasher.update(buffer[:n])
+            if dst is not None:
+                dst.write(buffer[:n])
+        return hasher.digest()[:DIGEST_SIZE]
+
+    def _hash_with_read_ahead(self, source: BinaryIO, hasher, dst) -> None:
+        """Feed hasher (and dst) in read order while a thread reads the next chunks.
+
+        zlib and the hashers release the GIL on large buffers, so reading and
+        inflating overlap with digest computation. Buffers cycle between a free
+        queue and a filled queue, which bounds memory and avoids per-chunk
+        allocation.
+        """
+        free_buffers = queue.Queue()
+        for buffer in self._read_ahead_buffers:
+            free_buffers.put(buffer)
+        filled_buffers = queue.Queue()
+        stop_reading = threading.Event()
+
+        def read_chunks() -> None:
+            try:
+                while True:
+                    buffer = free_buffers.get()
+                    if stop_reading.is_set():
+                        return
+                    n = source.readinto(buffer)
+                    filled_buffers.put((buffer, n))
+                    if not n:
+                        return
+            except Exception as e:
+                filled_buffers.put((e, 0))
+
+        reader = threading.Thread(target=read_chunks, daemon=True)
+        reader.start()
+        try:
+            while True:
+                buffer, n = filled_buffers.get()
+                if isinstance(buffer, Exception):
+                    raise buffer
+                if not n:
+                    break
+                chunk = memoryview(buffer)[:n]
+                hasher.update(chunk)
+                if dst is not None:
+                    dst.write(chunk)
+                free_buffers.put(buffer)
+        finally:
+            # Stop the reader (waking it if it waits for a buffer) before the
+            # buffers can be reused, including when a write has failed
+            stop_reading.set()
+            free_buffers.put(None)
+            reader.join()
+
+
+def _copy_range(fd: int, offset: int, size: int, dst, data: memoryview) -> None:
+    """Copy size bytes at offset of fd to the raw file dst.
+
+    copy_file_range keeps the data in the kernel (and reflinks it on btrfs
+    or XFS); whatever it cannot copy is written from data, the same bytes
+    already mapped for hashing.
+    """
+    copied = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < size:
+                n = os.copy_file_range(fd, dst.fileno(), size - copied, offset + copied)
+                if not n:
+                    break
+                copied += n
+        except OSError:
+            pass
+    remaining = data[copied:]
+    while remaining:
+        remaining = remaining[dst.write(remaining):]
+
+
+def _stored_data_offset(info: zipfile.ZipInfo) -> Optional[int]:
+    """Return where the bytes of an uncompressed, unencrypted entry start in
+    the archive, or None if the entry has to go through ZipFile.open."""
+    if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1 or not info.file_size:
+        return None
+    header = os.pread(_worker_zip.fp.fileno(), 30, info.header_offset)
+    if len(header) != 30 or header[:4] != b"PK\x03\x04":
+        return None
+    # The local header's name and extra field lengths can differ from the
+    # central directory's, so they are read from the local header itself
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    return info.header_offset + 30 + name_length + extra_length
+
+
+# Hasher of the current worker process, created by _init_hash_worker
+_worker_hasher: Optional[FileHasher] = None
+
+
+def _init_hash_worker(zip_path: Path, algorithm: str, chunk_size: int) -> None:
+    """Set up the archive and hasher of a hashing worker process."""
+    global _worker_hasher
+    _open_worker_zip(zip_path)
+    _worker_hasher = FileHasher(algorithm, chunk_size)
+
+
+def _hash_entry(entry_name: str, file_size: int, copy_to: Optional[Path] = None,
+                read_exif: bool = False) -> Tuple[bytes, Optional[datetime]]:
+    """Hash one archive entry, optionally copying it out and reading its EXIF
+    capture time too (runs in a worker process)."""
+    info = _worker_zip.getinfo(entry_name)
+    offset = _stored_data_offset(info)
+    if offset is not None:
+        # Stored entries are hashed and copied straight from the archive
+        file_hash = _worker_hasher.calculate_stored(
+            _worker_zip.fp.fileno(), offset, file_size, info.CRC, copy_to
+        )
+    else:
+        with _worker_zip.open(info) as src:
+            file_hash = _worker_hasher.calculate(src, file_size, copy_to)
+    if not read_exif:
+        return file_hash, None
+    if copy_to is not None:
+        return file_hash, _read_exif_timestamp(copy_to)
+    with _worker_zip.open(entry_name) as src:
+        return file_hash, _read_exif_timestamp(src)
+
 
 class TakeoutProcessor:
-    def __init__(self, output_dir: Path, convert_heic: bool = True):
+    def __init__(self, output_dir: Path, convert_heic: bool = True,
+                 chunk_size: int = CHUNK_SIZE, hash_algorithm: str = "blake3",
+                 optimize_jpeg: bool = False, workers: int = AVAILABLE_CPUS):
+        # Checked here too, since the hashers are only built in the workers
+        if chunk_size < MIN_CHUNK_SIZE:
+            raise ValueError(f"chunk_size must be at least {MIN_CHUNK_SIZE} bytes")
         self.output_dir = Path(output_dir)
         self.convert_heic = convert_heic
-        self.processed_hashes: Set[str] = set()
+        self.optimize_jpeg = optimize_jpeg
+        self.chunk_size = chunk_size
+        self.hash_algorithm = hash_algorithm
+        # libheif already decodes with several threads, so half as many HEIC
+        # workers as hashing workers keep conversion busy without
+        # oversubscribing the CPU
+        self.hash_workers = max(1, workers)
+        self.convert_workers = max(1, workers // 2)
         self.stats = {
             "total_files": 0,
             "processed": 0,
@@ -34,101 +350,393 @@ class TakeoutProcessor:
         }
         
         # Create output directories
-        (self.output_dir / "photos").mkdir(parents=True, exist_ok=True)
-        (self.output_dir / "videos").mkdir(parents=True, exist_ok=True)
-        (self.output_dir / "metadata").mkdir(parents=True, exist_ok=True)
+        self.photos_dir = self.output_dir / "photos"
+        self.videos_dir = self.output_dir / "videos"
+        self.metadata_dir = self.output_dir / "metadata"
+        for directory in (self.photos_dir, self.videos_dir, self.metadata_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+        
+        # Remove staging copies left behind by an earlier run that was killed
+        for directory in (self.photos_dir, self.videos_dir):
+            for stale_path in directory.glob(".takeout-*.part"):
+                stale_path.unlink(missing_ok=True)
+
+        # Persistent dedup index, so later exports skip already processed files
+        self.dedup_db = self._open_dedup_db(self.output_dir / "deduplication.sqlite")
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+
+        # Archive being processed and the names of its entries
+        self._zip_file: Optional[zipfile.ZipFile] = None
+        self._entry_names = set()
+        # Takeout metadata of the archive's output files, one JSON line each
+        self._metadata_file = None
+
+        # Entries being hashed:
+        # (future, entry, metadata, timestamp, prekey, entry key, stem, extension,
+        #  lowercase extension, staging copy)
+        self._hash_pool = None
+        self._pending_files = deque()
+        self._staged_files = 0
+
+        # HEIC conversions in flight: (future, source, hash, prekey, output, metadata)
+        self._convert_pool = None
+        self._pending_conversions = deque()
+        # Hashes of those conversions, which reach the index only once written,
+        # each with the duplicate entries skipped in its favour
+        self._claimed_hashes: Dict[bytes, List[zipfile.ZipInfo]] = {}
+        # Skipped entries whose conversion failed, to be tried again
+        self._retry_entries = deque()
+
+    def _open_dedup_db(self, db_path: Path) -> sqlite3.Connection:
+        """Open (and create if needed) the SQLite deduplication index."""
+        conn = sqlite3.connect(db_path)
+        # Only this process writes the index; exclusive locking lets WAL work
+        # without the shared-memory -shm file, which NAS mounts cannot map
+        conn.execute("PRAGMA locking_mode=EXCLUSIVE")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS dedup ("
+            "hash BLOB PRIMARY KEY, prekey TEXT, filename TEXT, processed_time REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_prekey ON dedup(prekey)")
+        # Hashes of archive entries seen before, so re-runs need not rehash them
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entry_hashes ("
+            "entry_key TEXT PRIMARY KEY, hash BLOB)"
+        )
+        # Digests of different algorithms never match, so the index records
+        # which one produced its hashes and refuses any other
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO meta VALUES ('hash_algorithm', ?)",
+            (self.hash_algorithm,)
+        )
+        conn.commit()
+        index_algorithm = conn.execute(
+            "SELECT value FROM meta WHERE key = 'hash_algorithm'"
+        ).fetchone()[0]
+        if index_algorithm != self.hash_algorithm:
+            conn.close()
+            raise ValueError(
+                f"{db_path} holds {index_algorithm} hashes; run with "
+                f"--hash-algorithm {index_algorithm} or use a new output directory"
+            )
+        return conn
+
+    def _is_duplicate(self, file_hash: bytes) -> bool:
+        """Check whether a file with this hash was already processed."""
+        if file_hash in self._claimed_hashes:
+            return True
+        row = self.dedup_db.execute(
+            "SELECT 1 FROM dedup WHERE hash = ? LIMIT 1", (file_hash,)
+        ).fetchone()
+        return row is not None
+
+    def _is_known_prekey(self, prekey: str) -> bool:
+        """Check whether an item with this metadata key was already processed."""
+        row = self.dedup_db.execute(
+            "SELECT 1 FROM dedup WHERE prekey = ? LIMIT 1", (prekey,)
+        ).fetchone()
+        return row is not None
+
+    def _cached_entry_hash(self, entry_key: str) -> Optional[bytes]:
+        """Look up the hash recorded for an archive entry by an earlier run."""
+        row = self.dedup_db.execute(
+            "SELECT hash FROM entry_hashes WHERE entry_key = ?", (entry_key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _record_entry_hash(self, entry_key: str, file_hash: bytes) -> None:
+        """Remember the hash of an archive entry for later runs."""
+        self.dedup_db.execute(
+            "INSERT OR REPLACE INTO entry_hashes VALUES (?, ?)", (entry_key, file_hash)
+        )
+        self._uncommitted += 1
+        self._maybe_commit_dedup()
+
+    def _record_hash(self, file_hash: bytes, prekey: Optional[str],
+                     output_path: Path) -> None:
+        """Add a processed file to the dedup index, committing in batches."""
+        self.dedup_db.execute(
+            "INSERT OR REPLACE INTO dedup VALUES (?, ?, ?, ?)",
+            (file_hash, prekey, output_path.name, datetime.now().timestamp())
+        )
+        self._uncommitted += 1
+        self._maybe_commit_dedup()
+
+    def _maybe_commit_dedup(self) -> None:
+        """Commit once enough rows or time have accumulated."""
+        if (self._uncommitted >= DEDUP_COMMIT_INTERVAL
+                or time.monotonic() - self._last_commit >= DEDUP_COMMIT_SECONDS):
+            self._commit_dedup()
+
+    def _commit_dedup(self) -> None:
+        """Commit pending dedup index inserts, if any."""
+        if self._uncommitted:
+            self.dedup_db.commit()
+            self._uncommitted = 0
+        self._last_commit = time.monotonic()
+
+    def close(self) -> None:
+        """Commit pending dedup index changes and close the database."""
+        self._commit_dedup()
+        self.dedup_db.close()
 
     def process_takeout_zip(self, zip_path: Path) -> None:
-        """Extract and process a Google Takeout ZIP file."""
+        """Process a Google Takeout ZIP file, streaming entries out of it."""
         print(f"Processing {zip_path.name}...")
         
-        with zipfile.ZipFile(zip_path, 'r') as zip_file:
-            # Extract to temporary directory
-            temp_dir = Path(f"/tmp/takeout_{datetime.now().timestamp()}")
-            zip_file.extractall(temp_dir)
-            
-            # Find all media files
-            media_files = []
-            for pattern in ["*.jpg", "*.jpeg", "*.png", "*.heic", "*.heif", "*.mp4", "*.mov"]:
-                media_files.extend(temp_dir.rglob(pattern))
-            
-            self.stats["total_files"] = len(media_files)
+        metadata_path = self.metadata_dir / f"{zip_path.stem}.jsonl"
+        with zipfile.ZipFile(zip_path, 'r') as zip_file, \
+                open(metadata_path, 'ab') as metadata_file:
+            # Entries are read straight from the archive, so nothing is
+            # extracted to a temporary directory first
+            self._zip_file = zip_file
+            self._metadata_file = metadata_file
+            self._entry_names = {info.filename for info in zip_file.infolist()}
             
-            # Process each file
-            for media_file in tqdm(media_files, desc="Processing files"):
-                self._process_media_file(media_file)
-            
-            # Cleanup
-            shutil.rmtree(temp_dir)
+            # Hashing (with copying) and HEIC decoding run in worker processes,
+            # each with its own handle on the archive; this loop only makes
+            # dedup decisions
+            try:
+                with ProcessPoolExecutor(
+                    max_workers=self.hash_workers, mp_context=MP_CONTEXT,
+                    initializer=_init_hash_worker,
+                    initargs=(zip_path, self.hash_algorithm, self.chunk_size)
+                ) as hash_pool, ProcessPoolExecutor(
+                    max_workers=self.convert_workers, mp_context=MP_CONTEXT,
+                    initializer=_open_worker_zip,
+                    initargs=(zip_path,)
+                ) as convert_pool:
+                    self._hash_pool = hash_pool
+                    self._convert_pool = convert_pool
+                    
+                    for info in tqdm(list(self._iter_media_entries(zip_file)),
+                                     desc="Processing files", unit="file"):
+                        self.stats["total_files"] += 1
+                        self._queue_media_file(info)
+                    
+                    self._finish_media_files()
+                    self._finish_conversions()
+                    while self._retry_entries:
+                        while self._retry_entries:
+                            self._queue_media_file(self._retry_entries.popleft())
+                        self._finish_media_files()
+                        self._finish_conversions()
+            finally:
+                # After an interruption, drop the staging copies of entries
+                # that were hashed but never stored (the pools have shut
+                # down by now, so no worker is still writing them)
+                while self._pending_files:
+                    staging_path = self._pending_files.popleft()[-1]
+                    if staging_path:
+                        staging_path.unlink(missing_ok=True)
+                self._retry_entries.clear()
+            self._hash_pool = None
+            self._convert_pool = None
+            self._zip_file = None
+            self._entry_names = set()
+            self._metadata_file = None
+
+    def _iter_media_entries(self, zip_file: zipfile.ZipFile) -> Iterator[zipfile.ZipInfo]:
+        """Yield the media entries of an archive, in archive order."""
+        for info in zip_file.infolist():
+            name = info.filename
+            if not info.is_dir() and name[name.rfind('.'):].lower() in MEDIA_EXTENSIONS:
+                yield info
 
-    def _process_media_file(self, file_path: Path) -> None:
-        """Process a single media file."""
+    def _queue_media_file(self, info: zipfile.ZipInfo) -> None:
+        """Look up a media entry's metadata and queue it for hashing."""
         try:
             # Look for associated JSON metadata
-            json_path = file_path.with_suffix(file_path.suffix + ".json")
-            metadata = self._load_metadata(json_path) if json_path.exists() else {}
+            json_name = info.filename + ".json"
+            metadata = self._load_metadata(json_name) if json_name in self._entry_names else {}
             
-            # Calculate file hash for deduplication
-            file_hash = self._calculate_hash(file_path)
-            if file_hash in self.processed_hashes:
+            # Items seen in an earlier export are skipped before hashing
+            prekey = self._get_prekey(metadata, info.file_size)
+            if prekey and self._is_known_prekey(prekey):
                 self.stats["duplicates"] += 1
                 return
             
-            # Determine output path
-            timestamp = self._get_timestamp(metadata, file_path)
-            is_video = file_path.suffix.lower() in ['.mp4', '.mov', '.avi']
+            # Entries hashed by an earlier run are checked without rehashing
+            entry_key = self._get_entry_key(info)
+            cached_hash = self._cached_entry_hash(entry_key)
+            if cached_hash and self._is_duplicate(cached_hash):
+                self._skip_duplicate(cached_hash, info)
+                return
+            
+            # Split the file name once; the parts route and name the output
+            name = info.filename.rpartition('/')[2]
+            dot = name.rfind('.')
+            stem, ext = name[:dot], name[dot:]
+            suffix = ext.lower()
+            
+            # Entries that are copied as-is are hashed and written out in one
+            # read, into a staging file next to their destination
+            staging_path = None
+            if not (self.convert_heic and suffix in HEIC_EXTENSIONS):
+                output_dir = self.videos_dir if suffix in VIDEO_EXTENSIONS else self.photos_dir
+                self._staged_files += 1
+                staging_path = output_dir / f".takeout-{os.getpid()}-{self._staged_files}.part"
+            
+            # Without a metadata timestamp the worker also reads the EXIF one
+            timestamp = self._get_metadata_timestamp(metadata)
+            read_exif = timestamp is None and suffix not in VIDEO_EXTENSIONS
+            
+            # Calculate file hash for deduplication in a worker process
+            future = self._hash_pool.submit(
+                _hash_entry, info.filename, info.file_size, staging_path, read_exif
+            )
+            self._pending_files.append(
+                (future, info, metadata, timestamp, prekey, entry_key, stem, ext,
+                 suffix, staging_path)
+            )
+            if len(self._pending_files) >= MAX_PENDING_FILES:
+                self._store_oldest_file()
             
-            if is_video:
-                output_dir = self.output_dir / "videos"
+        except Exception as e:
+            print(f"Error processing {info.filename}: {e}")
+            self.stats["errors"] += 1
+
+    def _finish_media_files(self) -> None:
+        """Wait for all queued hashes and store the files they belong to."""
+        while self._pending_files:
+            self._store_oldest_file()
+
+    def _store_oldest_file(self) -> None:
+        """Store the oldest queued file.
+        
+        It stays queued until stored, so an interruption while waiting for
+        its hash still leaves its staging copy to the cleanup.
+        """
+        self._store_media_file(self._pending_files[0])
+        self._pending_files.popleft()
+
+    def _store_media_file(self, pending: tuple) -> None:
+        """Deduplicate a hashed media file and write it to the backup.
+        
+        Files are stored in the order they were queued, so the first copy of
+        duplicated content always wins, as it did with serial processing.
+        """
+        (future, info, metadata, timestamp, prekey, entry_key, stem, ext,
+         suffix, staging_path) = pending
+        try:
+            file_hash, exif_time = future.result()
+            self._record_entry_hash(entry_key, file_hash)
+            if self._is_duplicate(file_hash):
+                # Roll back the copy made while hashing
+                if staging_path:
+                    staging_path.unlink()
+                self._skip_duplicate(file_hash, info)
+                return
+            
+            # Fall back to the EXIF capture time, then the entry's ZIP timestamp
+            if timestamp is None:
+                timestamp = exif_time or self._get_entry_timestamp(info)
+            
+            if suffix in VIDEO_EXTENSIONS:
+                output_dir = self.videos_dir
             else:
-                output_dir = self.output_dir / "photos"
+                output_dir = self.photos_dir
             
-            # Generate filename with date prefix
-            date_prefix = timestamp.strftime("%Y%m%d_%H%M%S")
-            output_filename = f"{date_prefix}_{file_path.stem}{file_path.suffix}"
+            # Generate filename with date prefix; converted HEICs become .jpg
+            convert = self.convert_heic and suffix in HEIC_EXTENSIONS
+            date_prefix = _format_date_prefix(timestamp)
+            output_filename = f"{date_prefix}_{stem}{'.jpg' if convert else ext}"
             output_path = output_dir / output_filename
             
             # Handle HEIC conversion
-            if self.convert_heic and file_path.suffix.lower() in ['.heic', '.heif']:
-                output_path = output_path.with_suffix('.jpg')
-                self._convert_heic_to_jpg(file_path, output_path)
-                self.stats["converted"] += 1
-            else:
-                # Copy file
-                shutil.copy2(file_path, output_path)
+            if convert:
+                future = self._convert_pool.submit(
+                    _convert_heic_to_jpg, info.filename, output_path, self.optimize_jpeg
+                )
+                # Claim the hash in memory so duplicates later in the run are
+                # skipped; it is indexed once the JPEG has been written
+                self._claimed_hashes[file_hash] = []
+                self._pending_conversions.append(
+                    (future, info.filename, file_hash, prekey, output_path, metadata)
+                )
+                if len(self._pending_conversions) >= MAX_PENDING_CONVERSIONS:
+                    self._collect_conversion(self._pending_conversions.popleft())
+                return
             
-            # Save metadata
-            if metadata:
-                meta_path = self.output_dir / "metadata" / f"{output_path.stem}.json"
-                with open(meta_path, 'w') as f:
-                    json.dump(metadata, f, indent=2)
+            # Move the copy written while hashing into place
+            os.replace(staging_path, output_path)
+            self._save_metadata(metadata, output_path)
             
-            self.processed_hashes.add(file_hash)
+            self._record_hash(file_hash, prekey, output_path)
             self.stats["processed"] += 1
             
         except Exception as e:
-            print(f"Error processing {file_path}: {e}")
+            print(f"Error processing {info.filename}: {e}")
             self.stats["errors"] += 1
+            if staging_path:
+                staging_path.unlink(missing_ok=True)
+
+    def _skip_duplicate(self, file_hash: bytes, info: zipfile.ZipInfo) -> None:
+        """Count a duplicate, or hold it back while its original is converting."""
+        skipped = self._claimed_hashes.get(file_hash)
+        if skipped is None:
+            self.stats["duplicates"] += 1
+        else:
+            skipped.append(info)
 
-    def _calculate_hash(self, file_path: Path) -> str:
-        """Calculate SHA256 hash of file."""
-        sha256_hash = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(byte_block)
-        return sha256_hash.hexdigest()
+    def _finish_conversions(self) -> None:
+        """Wait for all queued HEIC conversions and record their results."""
+        while self._pending_conversions:
+            self._collect_conversion(self._pending_conversions.popleft())
 
-    def _load_metadata(self, json_path: Path) -> Dict:
-        """Load metadata from JSON file."""
+    def _collect_conversion(self, pending: tuple) -> None:
+        """Wait for one HEIC conversion and record its result."""
+        future, entry_name, file_hash, prekey, output_path, metadata = pending
+        skipped = self._claimed_hashes.pop(file_hash)
         try:
-            with open(json_path, 'r') as f:
-                return json.load(f)
+            future.result()
+            self._save_metadata(metadata, output_path)
+            self._record_hash(file_hash, prekey, output_path)
+        except Exception as e:
+            print(f"Error processing {entry_name}: {e}")
+            self.stats["errors"] += 1
+            # The content was not stored, so give its skipped copies another try
+            self._retry_entries.extend(skipped)
+            return
+        self.stats["duplicates"] += len(skipped)
+        self.stats["converted"] += 1
+        self.stats["processed"] += 1
+
+    def _save_metadata(self, metadata: Dict, output_path: Path) -> None:
+        """Append the Takeout metadata of an output file, if there is any."""
+        if metadata:
+            self._metadata_file.write(
+                orjson.dumps({"name": output_path.name, **metadata},
+                             option=orjson.OPT_APPEND_NEWLINE)
+            )
+
+    def _get_entry_key(self, info: zipfile.ZipInfo) -> str:
+        """Identify an archive entry by name, size, CRC-32 and ZIP timestamp."""
+        return f"{info.filename}|{info.file_size}|{info.CRC:08x}|{info.date_time}"
+
+    def _get_prekey(self, metadata: Dict, file_size: int) -> Optional[str]:
+        """Build a cheap identity key from Takeout metadata, if available."""
+        title = metadata.get('title')
+        taken = metadata.get('photoTakenTime', {}).get('timestamp')
+        if not title or not taken:
+            return None
+        return f"{title}|{taken}|{file_size}"
+
+    def _load_metadata(self, json_name: str) -> Dict:
+        """Load metadata from a JSON entry of the archive."""
+        try:
+            return orjson.loads(self._zip_file.read(json_name))
         except:
             return {}
 
-    def _get_timestamp(self, metadata: Dict, file_path: Path) -> datetime:
-        """Extract timestamp from metadata or file."""
-        # Try metadata first
+    def _get_metadata_timestamp(self, metadata: Dict) -> Optional[datetime]:
+        """Extract timestamp from Takeout metadata, if present."""
         if metadata.get('photoTakenTime', {}).get('timestamp'):
             return datetime.fromtimestamp(
                 int(metadata['photoTakenTime']['timestamp'])
@@ -137,20 +745,15 @@ class TakeoutProcessor:
             return datetime.fromtimestamp(
                 int(metadata['creationTime']['timestamp'])
             )
-        
-        # Fall back to file modification time
-        return datetime.fromtimestamp(file_path.stat().st_mtime)
+        return None
 
-    def _convert_heic_to_jpg(self, input_path: Path, output_path: Path) -> None:
-        """Convert HEIC image to JPEG."""
-        image = Image.open(input_path)
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Save as JPEG with high quality
-        image.save(output_path, 'JPEG', quality=95, optimize=True)
+    def _get_entry_timestamp(self, info: zipfile.ZipInfo) -> datetime:
+        """Convert an entry's ZIP date, using the current time if it is invalid."""
+        try:
+            return datetime(*info.date_time)
+        except ValueError:
+            # Zeroed or out-of-range DOS dates, e.g. (1980, 0, 0, 0, 0, 0)
+            return datetime.now()
 
     def print_stats(self) -> None:
         """Print processing statistics."""
@@ -169,26 +772,45 @@ class TakeoutProcessor:
 @click.option('--output', '-o', required=True, help='Output directory path')
 @click.option('--convert-heic/--no-convert-heic', default=True, 
               help='Convert HEIC files to JPEG')
-def main(takeout_path: str, output: str, convert_heic: bool):
+@click.option('--chunk-size', type=click.IntRange(min=MIN_CHUNK_SIZE),
+              default=CHUNK_SIZE, show_default=True,
+              help='Read size in bytes used when hashing files')
+@click.option('--hash-algorithm', type=click.Choice(HASH_ALGORITHMS),
+              default='blake3', show_default=True,
+              help='Hash used for deduplication (keep it stable across runs)')
+@click.option('--optimize-jpeg', is_flag=True,
+              help='Optimise Huffman tables of converted JPEGs (slower, slightly smaller)')
+@click.option('--workers', type=click.IntRange(min=1), default=AVAILABLE_CPUS,
+              show_default=True, envvar='WORKERS',
+              help='Hashing worker processes; HEIC conversion uses half as many')
+def main(takeout_path: str, output: str, convert_heic: bool, chunk_size: int,
+         hash_algorithm: str, optimize_jpeg: bool, workers: int):
     """Process Google Takeout archives and organize photos."""
     takeout_path = Path(takeout_path)
     output_dir = Path(output)
     
-    processor = TakeoutProcessor(output_dir, convert_heic)
+    try:
+        processor = TakeoutProcessor(output_dir, convert_heic, chunk_size,
+                                     hash_algorithm, optimize_jpeg, workers)
+    except ValueError as e:
+        raise click.UsageError(str(e))
     
-    if takeout_path.is_file() and takeout_path.suffix == '.zip':
-        # Single ZIP file
-        processor.process_takeout_zip(takeout_path)
-    elif takeout_path.is_dir():
-        # Directory containing multiple ZIP files
-        zip_files = list(takeout_path.glob('*.zip'))
-        print(f"Found {len(zip_files)} ZIP files to process")
-        
-        for zip_file in zip_files:
-            processor.process_takeout_zip(zip_file)
-    else:
-        print("Please provide a ZIP file or directory containing ZIP files")
-        return
+    try:
+        if takeout_path.is_file() and takeout_path.suffix == '.zip':
+            # Single ZIP file
+            processor.process_takeout_zip(takeout_path)
+        elif takeout_path.is_dir():
+            # Directory containing multiple ZIP files
+            zip_files = list(takeout_path.glob('*.zip'))
+            print(f"Found {len(zip_files)} ZIP files to process")
+            
+            for zip_file in zip_files:
+                processor.process_takeout_zip(zip_file)
+        else:
+            print("Please provide a ZIP file or directory containing ZIP files")
+            return
+    finally:
+        processor.close()
     
     processor.print_stats()
 
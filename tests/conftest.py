@@ -0,0 +1,7 @@
+"""Shared pytest setup."""
+
+import sys
+from pathlib import Path
+
+# Make the processor importable when running `pytest tests/` from anywhere
+sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -0,0 +1,151 @@
+"""End-to-end tests of TakeoutProcessor on small generated Takeout archives."""
+
+import io
+import os
+import zipfile
+from datetime import datetime
+
+import orjson
+import pytest
+from PIL import Image
+
+import takeout_processor
+from takeout_processor import TakeoutProcessor
+
+# Worker pools must never hang the suite
+pytestmark = pytest.mark.timeout(120)
+
+PHOTOS = "Takeout/Google Photos/Photos from 2023/"
+TAKEN = 1686839422
+
+
+def _jpeg(color: str) -> bytes:
+    """Encode a small solid-colour JPEG (without EXIF)."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 24), color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def _heic(color: str) -> bytes:
+    """Encode a small solid-colour HEIC."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 24), color).save(buffer, "HEIF")
+    return buffer.getvalue()
+
+
+def _add(zip_file, name, data, date_time=(2023, 1, 1, 0, 0, 0),
+         compress_type=zipfile.ZIP_DEFLATED):
+    """Add one entry with a fixed ZIP date and compression."""
+    zip_file.writestr(zipfile.ZipInfo(name, date_time), data, compress_type=compress_type)
+
+
+@pytest.fixture
+def takeout_zip(tmp_path):
+    """A Takeout archive mixing stored and deflated entries, sidecars and a duplicate."""
+    zip_path = tmp_path / "takeout-001.zip"
+    with zipfile.ZipFile(zip_path, "w") as zip_file:
+        red = _jpeg("red")
+        _add(zip_file, PHOTOS + "IMG_1.jpg", red, compress_type=zipfile.ZIP_STORED)
+        _add(zip_file, PHOTOS + "IMG_1.jpg.json", orjson.dumps(
+            {"title": "IMG_1.jpg", "photoTakenTime": {"timestamp": str(TAKEN)}}))
+        _add(zip_file, PHOTOS + "IMG_1 copy.jpg", red)
+        _add(zip_file, PHOTOS + "IMG_2.JPG", _jpeg("blue"), date_time=(2021, 5, 5, 1, 1, 22))
+        _add(zip_file, PHOTOS + "IMG_3.heic", _heic("green"))
+        _add(zip_file, PHOTOS + "IMG_3.heic.json", orjson.dumps(
+            {"title": "IMG_3.heic", "photoTakenTime": {"timestamp": str(TAKEN + 1)}}))
+        _add(zip_file, PHOTOS + "VID_1.mp4", os.urandom(2 * 1024 * 1024),
+             date_time=(2022, 1, 2, 3, 4, 6), compress_type=zipfile.ZIP_STORED)
+        _add(zip_file, PHOTOS + "VID_2.mp4", os.urandom(2 * 1024 * 1024),
+             date_time=(1980, 0, 0, 0, 0, 0))
+        _add(zip_file, PHOTOS + "notes.txt", b"not media")
+    return zip_path
+
+
+def _run(zip_path, output_dir, **options) -> dict:
+    """Process one archive into output_dir and return the statistics."""
+    processor = TakeoutProcessor(output_dir, workers=1, **options)
+    try:
+        processor.process_takeout_zip(zip_path)
+    finally:
+        processor.close()
+    return processor.stats
+
+
+def test_processes_stored_and_deflated_entries(takeout_zip, tmp_path):
+    output_dir = tmp_path / "out"
+    stats = _run(takeout_zip, output_dir)
+
+    assert stats == {"total_files": 6, "processed": 5, "duplicates": 1,
+                     "converted": 1, "errors": 0}
+
+    prefix = datetime.fromtimestamp(TAKEN).strftime("%Y%m%d_%H%M%S")
+    photos = sorted(p.name for p in (output_dir / "photos").iterdir())
+    heic_prefix = datetime.fromtimestamp(TAKEN + 1).strftime("%Y%m%d_%H%M%S")
+    assert photos == sorted([f"{prefix}_IMG_1.jpg", "20210505_010122_IMG_2.JPG",
+                             f"{heic_prefix}_IMG_3.jpg"])
+
+    # Copies are byte-identical to the archive, whichever path wrote them
+    with zipfile.ZipFile(takeout_zip) as zip_file:
+        assert (output_dir / "photos" / f"{prefix}_IMG_1.jpg").read_bytes() == \
+            zip_file.read(PHOTOS + "IMG_1.jpg")
+        assert (output_dir / "videos" / "20220102_030406_VID_1.mp4").read_bytes() == \
+            zip_file.read(PHOTOS + "VID_1.mp4")
+        # An invalid ZIP date must not keep the file out of the backup
+        [vid_2] = (output_dir / "videos").glob("*_VID_2.mp4")
+        assert vid_2.read_bytes() == zip_file.read(PHOTOS + "VID_2.mp4")
+
+    with Image.open(output_dir / "photos" / f"{heic_prefix}_IMG_3.jpg") as image:
+        assert image.format == "JPEG"
+
+    # Sidecar metadata goes to one JSON line per stored file
+    lines = (output_dir / "metadata" / "takeout-001.jsonl").read_bytes().splitlines()
+    names = {orjson.loads(line)["name"] for line in lines}
+    assert names == {f"{prefix}_IMG_1.jpg", f"{heic_prefix}_IMG_3.jpg"}
+
+    # No staging copies are left behind
+    assert not list(output_dir.rglob(".takeout-*.part"))
+
+
+def test_second_run_skips_everything(takeout_zip, tmp_path):
+    output_dir = tmp_path / "out"
+    _run(takeout_zip, output_dir)
+    stats = _run(takeout_zip, output_dir)
+
+    assert stats == {"total_files": 6, "processed": 0, "duplicates": 6,
+                     "converted": 0, "errors": 0}
+
+
+def test_hash_algorithm_mismatch_is_refused(takeout_zip, tmp_path):
+    output_dir = tmp_path / "out"
+    _run(takeout_zip, output_dir, hash_algorithm="blake3")
+
+    with pytest.raises(ValueError, match="blake3"):
+        TakeoutProcessor(output_dir, hash_algorithm="sha256")
+
+
+def test_corrupt_stored_entry_fails_crc_check(tmp_path):
+    data = os.urandom(256 * 1024)
+    zip_path = tmp_path / "corrupt.zip"
+    with zipfile.ZipFile(zip_path, "w") as zip_file:
+        _add(zip_file, PHOTOS + "IMG_1.jpg", data, compress_type=zipfile.ZIP_STORED)
+
+    # Flip one byte inside the stored data
+    archive = bytearray(zip_path.read_bytes())
+    archive[archive.find(data) + 1000] ^= 0xFF
+    zip_path.write_bytes(archive)
+
+    copy_to = tmp_path / "copy.jpg"
+    takeout_processor._init_hash_worker(zip_path, "blake3", takeout_processor.CHUNK_SIZE)
+    try:
+        with pytest.raises(zipfile.BadZipFile, match="CRC-32"):
+            takeout_processor._hash_entry(PHOTOS + "IMG_1.jpg", len(data), copy_to)
+    finally:
+        takeout_processor._worker_zip.close()
+    assert not copy_to.exists()
+
+    # The processor reports the entry as an error and stores nothing
+    output_dir = tmp_path / "out"
+    stats = _run(zip_path, output_dir)
+    assert stats["errors"] == 1
+    assert stats["processed"] == 0
+    assert not list((output_dir / "photos").iterdir())